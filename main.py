@@ -1,152 +1,269 @@
-import dxfgrabber
+import ezdxf
+from ezdxf.addons import iterdxf
 from fpdf import FPDF
 import math
-from dataclasses import dataclass, replace
+import numpy as np
+from dataclasses import dataclass, field
 import argparse
-import copy
+from typing import NamedTuple
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Params:
     orientation: str = "landscape"
     scale: float = 2.5
     overlap: float = 0.5
     margin: float = 0.25
 
+    # Derived from the fields above in __post_init__.
+    page_h: float = field(init=False, repr=False)
+    page_w: float = field(init=False, repr=False)
+    cutx: float = field(init=False, repr=False)
+    cuty: float = field(init=False, repr=False)
+
     def __post_init__(self):
         if self.orientation == "landscape":
-            self.page_h = 8.5
-            self.page_w = 11
+            page_h, page_w = 8.5, 11
         else:
-            self.page_h = 11
-            self.page_w = 8.5
+            page_h, page_w = 11, 8.5
 
-        self.cutx = (self.page_w - self.overlap - 2*self.margin)/self.scale
-        self.cuty = (self.page_h - self.overlap - 2*self.margin)/self.scale
+        object.__setattr__(self, 'page_h', page_h)
+        object.__setattr__(self, 'page_w', page_w)
+        object.__setattr__(self, 'cutx', (page_w - self.overlap - 2*self.margin)/self.scale)
+        object.__setattr__(self, 'cuty', (page_h - self.overlap - 2*self.margin)/self.scale)
 
-@dataclass
-class Point:
+class Point(NamedTuple):
     x: float = 0.0
     y: float = 0.0
 
-    def offset(self, offset: 'Point'):
-        self.x = self.x - offset.x
-        self.y = self.y - offset.y
-
-@dataclass
+@dataclass(slots=True)
 class RectXY:
     bl: Point
     tr: Point
 
-    def offset(self, offset: Point):
-        self.bl.offset(offset)
-        self.tr.offset(offset)
+@dataclass(slots=True)
+class LineBatch:
+    """All LINE entities stored as parallel coordinate arrays."""
+    sx: np.ndarray
+    sy: np.ndarray
+    ex: np.ndarray
+    ey: np.ndarray
 
-@dataclass
-class Line:
-    start: Point
-    end: Point
+    @staticmethod
+    def dxf_row(e):
+        """(sx, sy, ex, ey) of a DXF LINE entity."""
+        s = e.dxf.start
+        t = e.dxf.end
+        return s[0], s[1], t[0], t[1]
 
     @staticmethod
-    def from_dxf(e):
-        return Line(start=Point(e.start[0], e.start[1]), end=Point(e.end[0], e.end[1]))
-
-    def bounds(self) -> RectXY:
-        return RectXY(Point(min(self.start.x, self.end.x),
-                            min(self.start.y, self.end.y)),
-                      Point(max(self.start.x, self.end.x), 
-                            max(self.start.y, self.end.y)))
-
-    def offset(self, offset: Point):
-        self.start.offset(offset)
-        self.end.offset(offset)
-        
-@dataclass
-class Arc:
-    center: Point
-    r: float = 0.0
-    start_angle: float = 0.0
-    end_angle: float = 0.0
+    def from_rows(rows):
+        coords = np.array(rows, dtype=np.float64).reshape(-1, 4)
+        return LineBatch(*np.ascontiguousarray(coords.T))
+
+    def __len__(self):
+        return len(self.sx)
+
+    def entity_bounds(self):
+        """Per-line bounding boxes as an (N, 4) array of (min_x, min_y, max_x, max_y)."""
+        return np.stack([np.minimum(self.sx, self.ex), np.minimum(self.sy, self.ey),
+                         np.maximum(self.sx, self.ex), np.maximum(self.sy, self.ey)], axis=1)
+
+    def select(self, mask) -> 'LineBatch':
+        return LineBatch(self.sx[mask], self.sy[mask], self.ex[mask], self.ey[mask])
+
+def compute_arc_bounds_batch(cx, cy, r, sa, ea):
+    """Per-arc bounding boxes as (min_x, min_y, max_x, max_y) arrays."""
+    sa_rad = np.radians(sa)
+    ea_rad = np.radians(ea)
+    x0 = cx + r*np.cos(sa_rad)
+    y0 = cy + r*np.sin(sa_rad)
+    x1 = cx + r*np.cos(ea_rad)
+    y1 = cy + r*np.sin(ea_rad)
+    min_x, max_x = np.minimum(x0, x1), np.maximum(x0, x1)
+    min_y, max_y = np.minimum(y0, y1), np.maximum(y0, y1)
+
+    # The arc also reaches cx +/- r or cy +/- r whenever it sweeps through
+    # one of the axis angles, i.e. when the axis angle lies within the
+    # counter-clockwise span from sa to ea. A span of 0 (sa == ea, or e.g.
+    # 0 to 360) is a full circle, which is also how pdf.arc() draws it.
+    ang = np.array([0, 90, 180, 270])
+    span = (ea - sa) % 360
+    span[span == 0] = 360
+    incl = (ang - sa[:, None]) % 360 <= span[:, None]
+    max_x = np.where(incl[:, 0], cx + r, max_x)
+    max_y = np.where(incl[:, 1], cy + r, max_y)
+    min_x = np.where(incl[:, 2], cx - r, min_x)
+    min_y = np.where(incl[:, 3], cy - r, min_y)
+    return min_x, min_y, max_x, max_y
+
+@dataclass(slots=True)
+class ArcBatch:
+    """All ARC entities stored as parallel arrays. Angles are in degrees."""
+    cx: np.ndarray
+    cy: np.ndarray
+    r: np.ndarray
+    start_angle: np.ndarray
+    end_angle: np.ndarray
 
     @staticmethod
-    def from_dxf(e):
-        return Arc(center= Point(e.center[0], e.center[1]), r=e.radius,
-                   start_angle=e.start_angle, end_angle=e.end_angle)
-
-    def bounds(self):
-        cx, cy = self.center.x, self.center.y
-        max_x = -math.inf
-        min_x = math.inf
-        max_y = -math.inf
-        min_y = math.inf
-
-        angles = [self.start_angle, self.end_angle]
-        wrap = self.start_angle > self.end_angle
-        for extra_angle in [0, 90, 180, 270]:
-            if ((self.start_angle <= extra_angle <= self.end_angle) or 
-                (wrap and extra_angle <= self.end_angle) or
-                (wrap and self.start_angle <= extra_angle)):
-                angles.append(extra_angle)
-
-        # print(f'{angles=}')
-        for angle in angles:
-            x = cx + self.r*math.cos(angle * math.pi/180)
-            y = cy + self.r*math.sin(angle * math.pi/180)
-            max_x = max(max_x, x)
-            max_y = max(max_y, y)
-            min_x = min(min_x, x)
-            min_y = min(min_y, y)
-
-        return RectXY(Point(min_x, min_y), Point(max_x, max_y))
-
-    def offset(self, offset: Point):
-        self.center.offset(offset)
-
-def update_bounds(bb1: RectXY, bb2: RectXY):
-    bl = Point(min(bb1.bl.x, bb2.bl.x), min(bb1.bl.y, bb2.bl.y))
-    tr = Point(max(bb1.tr.x, bb2.tr.x), max(bb1.tr.y, bb2.tr.y))
-    return RectXY(bl, tr)
-
-def draw_page(params: Params, entities, pdf, bb: Point, offset: Point):
-    ox = offset.x
-    oy = offset.y
-
-    def draw_line(x1, y1, x2, y2):
-        pdf.line(x1=params.scale*(x1+ox)+params.margin, 
-                 y1=params.page_h-params.scale*(y1+oy)-params.margin,
-                 x2=params.scale*(x2+ox)+params.margin,
-                 y2=params.page_h-params.scale*(y2+oy)-params.margin)
-
-    def draw_arc(e: Arc):
-        cx = params.scale*(e.center.x+ox)
-        cy = params.scale*(e.center.y+oy)
-        r = params.scale*e.r
-        pdf.arc(x=cx-r+params.margin, y=params.page_h-(cy+r)-params.margin, a=2*r, b=2*r,
-                end_angle=360-e.start_angle, start_angle=360-e.end_angle)
+    def dxf_row(e):
+        """(cx, cy, r, start_angle, end_angle) of a DXF ARC entity."""
+        d = e.dxf
+        c = d.center
+        return c[0], c[1], d.radius, d.start_angle, d.end_angle
 
-    pdf.set_draw_color(200)
+    @staticmethod
+    def from_rows(rows):
+        values = np.array(rows, dtype=np.float64).reshape(-1, 5)
+        return ArcBatch(*np.ascontiguousarray(values.T))
+
+    def __len__(self):
+        return len(self.cx)
+
+    def entity_bounds(self):
+        """Per-arc bounding boxes as an (N, 4) array of (min_x, min_y, max_x, max_y)."""
+        return np.stack(compute_arc_bounds_batch(self.cx, self.cy, self.r,
+                                                 self.start_angle, self.end_angle), axis=1)
+
+    def select(self, mask) -> 'ArcBatch':
+        return ArcBatch(self.cx[mask], self.cy[mask], self.r[mask],
+                        self.start_angle[mask], self.end_angle[mask])
+
+def make_cut_marks(params: Params, origin: Point, num_cutsx: int, num_cutsy: int) -> LineBatch:
+    """Small crosses at every page corner, in DXF coordinates."""
+    xs, ys = np.meshgrid(origin.x + np.arange(num_cutsx+1)*params.cutx,
+                         origin.y + np.arange(num_cutsy+1)*params.cuty)
+    xs = xs.ravel()
+    ys = ys.ravel()
+    d = 0.25/params.scale
+    return LineBatch(sx=np.concatenate([xs - d, xs]), sy=np.concatenate([ys, ys - d]),
+                     ex=np.concatenate([xs + d, xs]), ey=np.concatenate([ys, ys + d]))
+
+def make_hatch(params: Params, origin: Point, size: Point) -> LineBatch:
+    """Diagonal alignment hatch across the bottom of the drawing, in DXF coordinates."""
+    r = min(size.x, size.y)
+    x1 = origin.x + np.arange(math.ceil(params.scale*(size.x+2*r))+1)/params.scale - r
+    x2 = x1 + r
+    y1 = np.full_like(x1, origin.y)
+    y2 = y1 + r
+    return LineBatch(sx=np.concatenate([x1, x1]), sy=np.concatenate([y1, y2]),
+                     ex=np.concatenate([x2, x2]), ey=np.concatenate([y2, y1]))
+
+def overlaps(bbs, rect: RectXY):
+    """Mask of the (N, 4) bounding boxes in bbs which intersect rect.
+
+    The boxes must cover everything draw_page() emits for an entity. An arc
+    with start_angle == end_angle is drawn as a full circle, so it still
+    overlaps a page on the far side from its start point:
+
+    >>> arcs = ArcBatch(cx=np.array([0.0]), cy=np.array([0.0]), r=np.array([1.0]),
+    ...                 start_angle=np.array([0.0]), end_angle=np.array([0.0]))
+    >>> overlaps(arcs.entity_bounds(), RectXY(Point(-2.0, -2.0), Point(-0.5, 2.0)))
+    array([ True])
+    """
+    return ((bbs[:, 0] <= rect.tr.x) & (bbs[:, 2] >= rect.bl.x) &
+            (bbs[:, 1] <= rect.tr.y) & (bbs[:, 3] >= rect.bl.y))
+
+def draw_lines(pdf, x1, y1, x2, y2):
+    """Draw a line for each entry of the page-coordinate arrays x1, y1, x2, y2.
+
+    Produces the same output as calling pdf.line() per line, but formats
+    the whole batch in one go and appends it to the page content stream
+    with a single write.
+    """
+    if len(x1) == 0:
+        return
+
+    k = pdf.k
+    h = pdf.h
+    pdf._out("\n".join(map("%.2f %.2f m %.2f %.2f l S".__mod__,
+                           zip((x1*k).tolist(), ((h - y1)*k).tolist(),
+                               (x2*k).tolist(), ((h - y2)*k).tolist()))))
+
+def draw_page(params: Params, lines: LineBatch, arcs: ArcBatch, hatch: LineBatch,
+              cut_marks: LineBatch, pdf, origin: Point, offset: Point):
+    # Everything is in DXF coordinates, which map to page coordinates as
+    # (x*s + tx, ty - y*s). The lower-left corner of the drawing (origin)
+    # ends up at offset from the bottom-left corner of the page margins.
+    s = params.scale
+    tx = s*(offset.x - origin.x) + params.margin
+    ty = params.page_h - s*(offset.y - origin.y) - params.margin
+
+    def draw_batch(b: LineBatch):
+        draw_lines(pdf, b.sx*s + tx, ty - b.sy*s, b.ex*s + tx, ty - b.ey*s)
 
-    bb_r = min(bb.x, bb.y)
-    for i in range(math.ceil(params.scale*(bb.x+2*bb_r))+1):
-        x1 = i/params.scale - bb_r
-        x2 = x1 + bb_r
-        draw_line(x1, 0, x2, bb_r)
-        draw_line(x1, bb_r, x2, 0)
+    pdf.set_draw_color(200)
+    draw_batch(hatch)
 
     pdf.set_draw_color(r=0, g=0, b=0)
+    draw_batch(lines)
+
+    r = arcs.r*s
+    for x, y, d, sa, ea in zip((arcs.cx*s + tx - r).tolist(), (ty - arcs.cy*s - r).tolist(),
+                               (2*r).tolist(), arcs.start_angle.tolist(),
+                               arcs.end_angle.tolist()):
+        pdf.arc(x=x, y=y, a=d, b=d, end_angle=360-sa, start_angle=360-ea)
+
+    draw_batch(cut_marks)
+
+def iterdxf_entity_types(dxf):
+    """DXF types of all entities in the ENTITIES section of an opened IterDXF.
+
+    IterDXF has no public API for this, so this reads its file index
+    (IterDXF.structure.index and IterDXF.sections) directly. That layout is
+    undocumented and this relies on the pinned ezdxf 1.4.4.
+    """
+    entity_types = set()
+    for entry in dxf.structure.index[dxf.sections['ENTITIES']+1:]:
+        if entry.value == 'ENDSEC':
+            break
+        entity_types.add(entry.value)
+    return entity_types
+
+def stream_modelspace(filename):
+    """Modelspace entities of a DXF file, streamed with iterdxf.
+
+    Raises DXFStructureError for files iterdxf cannot stream, e.g. binary
+    DXF, files without an OBJECTS section, or files containing entity
+    types which iterdxf would silently skip.
+    """
+    dxf = iterdxf.opendxf(filename)
+    try:
+        skipped = iterdxf_entity_types(dxf) - iterdxf.SUPPORTED_TYPES
+        if skipped:
+            raise ezdxf.DXFStructureError(
+                f"iterdxf does not support entity types: {', '.join(sorted(skipped))}")
+
+        yield from dxf.modelspace()
+    finally:
+        dxf.close()
+
+def read_rows(entities):
+    """Read the LINE and ARC entities into lists of coordinate rows.
+
+    Only the floats are kept, so a streamed entity can be freed as soon as
+    it has been read.
+    """
+    line_rows = []
+    arc_rows = []
+    readers = {'LINE': (line_rows, LineBatch.dxf_row),
+               'ARC': (arc_rows, ArcBatch.dxf_row)}
     for e in entities:
-        if isinstance(e, Line):
-            draw_line(e.start.x, e.start.y, e.end.x, e.end.y)
-        if isinstance(e, Arc):
-            draw_arc(e)
-
-    num_cutsx = math.ceil(bb.x/params.cutx)
-    num_cutsy = math.ceil(bb.y/params.cuty)
-    for i in range(num_cutsx+1):
-        for j in range(num_cutsy+1):
-            x = i*params.cutx
-            y = j*params.cuty
-            draw_line(x-0.25/params.scale, y, x+0.25/params.scale, y)
-            draw_line(x, y-0.25/params.scale, x, y+0.25/params.scale)
+        dxftype = e.dxftype()
+        reader = readers.get(dxftype)
+        if reader is None:
+            raise ValueError(f"Unsupported entity type: {dxftype}")
+        rows, dxf_row = reader
+        rows.append(dxf_row(e))
+    return line_rows, arc_rows
+
+def read_dxf(filename):
+    # Stream the modelspace entities rather than loading the whole DXF
+    # document into memory, unless iterdxf cannot handle the file.
+    try:
+        return read_rows(stream_modelspace(filename))
+    except ezdxf.DXFStructureError:
+        return read_rows(ezdxf.readfile(filename).modelspace())
 
 def main():
     parser = argparse.ArgumentParser(description='Convert DXF to PDF')
@@ -157,28 +274,15 @@ def main():
 
     args = parser.parse_args()
 
-    dxf = dxfgrabber.readfile(args.dxf)
-    bb = RectXY(bl = Point(math.inf, math.inf), 
-                tr = Point(-math.inf, -math.inf))
-    entities = []
-    for e in dxf.entities:
-        if e.dxftype == 'LINE':
-            entity = Line.from_dxf(e)
-            entities.append(Line.from_dxf(e))
-        elif e.dxftype == 'ARC':
-            entity = Arc.from_dxf(e)
-        else:
-            raise ValueError(f"Unsupported entity type: {e.dxftype}")
-
-        entities.append(entity)
-        bounds = entity.bounds()
-        # print(f'{entity} -> {bounds.bl.y} -> {bounds.tr.y}')
-        bb = update_bounds(bb, bounds)
-
-    for e in entities:
-        e.offset(bb.bl)
-
-    bb.offset(replace(bb.bl))
+    line_rows, arc_rows = read_dxf(args.dxf)
+    lines = LineBatch.from_rows(line_rows)
+    arcs = ArcBatch.from_rows(arc_rows)
+    line_bbs = lines.entity_bounds()
+    arc_bbs = arcs.entity_bounds()
+    all_bbs = np.concatenate([line_bbs, arc_bbs])
+    origin = Point(*all_bbs[:, :2].min(axis=0).tolist())
+    tr_x, tr_y = all_bbs[:, 2:].max(axis=0).tolist()
+    bb = RectXY(Point(0.0, 0.0), Point(tr_x - origin.x, tr_y - origin.y))
     print(f"Bounding box: {bb}")
     orientation = "landscape" if bb.tr.x > bb.tr.y else "portrait"
 
@@ -194,24 +298,43 @@ def main():
     num_cutsy = math.ceil(bb.tr.y/params.cuty)
     print(f"cutx: {params.cutx}, cuty: {params.cuty}")
     print(f"Cutting into {num_cutsx} x {num_cutsy} pages")
+
+    tol = 0.5/25.4
+    # Size of the clipped drawing area of a page in drawing units.
+    visible_w = (params.page_w + 2*tol - 2*params.margin)/params.scale
+    visible_h = (params.page_h + 2*tol - 2*params.margin)/params.scale
+    hatch = make_hatch(params, origin, bb.tr)
+    hatch_bbs = hatch.entity_bounds()
+    cut_marks = make_cut_marks(params, origin, num_cutsx, num_cutsy)
+    cut_mark_bbs = cut_marks.entity_bounds()
     for i in range(num_cutsx):
         for j in range(num_cutsy):
             x = i*params.cutx
             y = j*params.cuty
 
+            visible = RectXY(Point(origin.x + x - tol/params.scale,
+                                   origin.y + y - tol/params.scale),
+                             Point(origin.x + x + visible_w, origin.y + y + visible_h))
+            page_lines = lines.select(overlaps(line_bbs, visible))
+            page_arcs = arcs.select(overlaps(arc_bbs, visible))
+            if len(page_lines) == 0 and len(page_arcs) == 0:
+                print(f"Skipping empty page ({i}, {j})")
+                continue
+
+            page_hatch = hatch.select(overlaps(hatch_bbs, visible))
+            page_cut_marks = cut_marks.select(overlaps(cut_mark_bbs, visible))
+
             pdf.add_page()
-            tol = 0.5/25.4
             with pdf.rect_clip(params.margin-tol, params.margin-tol, 
                                params.page_w+2*tol - 2*params.margin, 
                                params.page_h+2*tol - 2*params.margin):
-                draw_page(params, entities, pdf, bb.tr, Point(-x, -y))
+                draw_page(params, page_lines, page_arcs, page_hatch, page_cut_marks, pdf,
+                          origin, Point(-x, -y))
 
             pdf.text(0.3, 0.4, text=f'({i}, {j})')
 
     pdf.output(args.pdf)
 
 
-# arc = Arc(center=Point(x=2.999999999999995, y=39.27596614930593), r=30.7812500000007, start_angle=270.0, end_angle=273.7253958543048)
-# print(arc.bounds())
-
-main()
+if __name__ == "__main__":
+    main()